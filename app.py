@@ -1,14 +1,18 @@
+import asyncio
 import os
+import shutil
 import time
+import uuid
 import logging
 
+import aiofiles
 from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 
 import config
 import embedder
 import vector_store
-from document_pipeline import ingest_file
+from document_pipeline import prepare_document, store_document
 from models import (
     QueryRequest,
     QueryResponse,
@@ -24,22 +28,39 @@ from models import (
 logging.basicConfig(level=getattr(logging, config.LOG_LEVEL.upper(), logging.INFO))
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="RAG Service", version="1.0.0")
+# orjson serializes text-heavy /query and /documents payloads much faster
+# than the stdlib json encoder
+app = FastAPI(
+    title="RAG Service",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 _start_time = time.time()
 
+# Uploads are streamed to disk in pieces of this size
+_UPLOAD_READ_BYTES = 1 << 20
+
 
 @app.on_event("startup")
 async def startup():
     logger.info("Loading embedding model: %s", config.EMBEDDING_MODEL)
     embedder.load_model()
     logger.info("Embedding model loaded (dim=%d)", embedder.get_embedding_dimension())
+    embedder.start_batchers()
+
+    os.makedirs(config.UPLOAD_PATH, exist_ok=True)
 
     logger.info("Initializing vector store at: %s", config.LANCEDB_PATH)
     vector_store.init_store()
     logger.info("Vector store ready")
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    await embedder.stop_batchers()
+
+
 @app.get("/")
 async def serve_ui():
     return FileResponse("static/index.html")
@@ -47,7 +68,6 @@ async def serve_ui():
 
 @app.post("/upload", response_model=UploadResponse)
 async def upload_files(files: list[UploadFile] = File(...)):
-    results = []
     for file in files:
         ext = os.path.splitext(file.filename or "")[1].lower()
         if ext not in config.SUPPORTED_EXTENSIONS:
@@ -56,36 +76,73 @@ async def upload_files(files: list[UploadFile] = File(...)):
                 detail=f"Unsupported file type: {ext}. Supported: {', '.join(config.SUPPORTED_EXTENSIONS)}",
             )
 
-        # Save uploaded file to temp location
-        os.makedirs(config.UPLOAD_PATH, exist_ok=True)
-        safe_temp_name = file.filename.replace("/", "__").replace("\\", "__")
-        temp_path = os.path.join(config.UPLOAD_PATH, f"_temp_{safe_temp_name}")
-        try:
-            content = await file.read()
-
-            if len(content) > config.MAX_UPLOAD_SIZE_MB * 1024 * 1024:
-                raise HTTPException(
-                    status_code=413,
-                    detail=f"File too large. Max size: {config.MAX_UPLOAD_SIZE_MB}MB",
-                )
-
-            with open(temp_path, "wb") as f:
-                f.write(content)
-
-            result = ingest_file(temp_path, file.filename)
-            results.append(
-                UploadedDocumentInfo(
-                    id=result["id"],
-                    filename=result["filename"],
-                    chunks=result["chunks"],
-                    status=result["status"],
-                )
-            )
-        finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+    # Ingest all files concurrently
+    outcomes = await asyncio.gather(
+        *[_ingest_upload(file) for file in files], return_exceptions=True
+    )
 
-    return UploadResponse(documents=results)
+    for file, outcome in zip(files, outcomes):
+        if not isinstance(outcome, BaseException):
+            continue
+        # The upload fails as a whole, so undo the files that did get indexed;
+        # otherwise a retry would index them a second time
+        indexed = [o.id for o in outcomes if not isinstance(o, BaseException)]
+        await asyncio.to_thread(_discard_documents, indexed)
+        if isinstance(outcome, HTTPException):
+            raise outcome
+        logger.error("Failed to ingest %s", file.filename, exc_info=outcome)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to ingest {file.filename}: {outcome}",
+        )
+
+    return UploadResponse(documents=outcomes)
+
+
+def _discard_documents(doc_ids: list[str]):
+    """Remove the chunks and saved uploads of documents from a failed upload."""
+    for doc_id in doc_ids:
+        vector_store.delete_document(doc_id)
+        shutil.rmtree(os.path.join(config.UPLOAD_PATH, doc_id), ignore_errors=True)
+
+
+async def _ingest_upload(file: UploadFile) -> UploadedDocumentInfo:
+    """Save one uploaded file to a temp location and ingest it off the event loop."""
+    safe_temp_name = file.filename.replace("/", "__").replace("\\", "__")
+    # Unique prefix: concurrent uploads may share a filename
+    temp_path = os.path.join(
+        config.UPLOAD_PATH, f"_temp_{uuid.uuid4().hex[:8]}_{safe_temp_name}"
+    )
+    try:
+        # Starlette has already spooled the request body; copying in pieces
+        # only avoids a second in-memory copy of the whole file
+        size = 0
+        async with aiofiles.open(temp_path, "wb") as f:
+            while chunk := await file.read(_UPLOAD_READ_BYTES):
+                size += len(chunk)
+                if size > config.MAX_UPLOAD_SIZE_MB * 1024 * 1024:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large. Max size: {config.MAX_UPLOAD_SIZE_MB}MB",
+                    )
+                await f.write(chunk)
+
+        # Parse/chunk and store on worker threads; chunks are embedded by the
+        # shared ingest batcher together with chunks from concurrent uploads
+        prepared = await asyncio.to_thread(prepare_document, temp_path, file.filename)
+        vectors = None
+        if prepared["chunks"]:
+            vectors = await embedder.embed_batch_async(prepared["chunks"])
+        result = await asyncio.to_thread(store_document, prepared, vectors)
+        return UploadedDocumentInfo(
+            id=result["id"],
+            filename=result["filename"],
+            chunks=result["chunks"],
+            status=result["status"],
+        )
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
 
 @app.get("/documents", response_model=DocumentListResponse)
@@ -107,15 +164,14 @@ async def list_documents():
 
 @app.delete("/documents/{doc_id}", response_model=DeleteResponse)
 async def delete_document(doc_id: str):
-    count = vector_store.delete_document(doc_id)
+    count = await asyncio.to_thread(vector_store.delete_document, doc_id)
     if count == 0:
         raise HTTPException(status_code=404, detail=f"Document {doc_id} not found")
 
     # Remove uploaded file
     upload_dir = os.path.join(config.UPLOAD_PATH, doc_id)
     if os.path.exists(upload_dir):
-        import shutil
-        shutil.rmtree(upload_dir)
+        await asyncio.to_thread(shutil.rmtree, upload_dir)
 
     return DeleteResponse(id=doc_id, deleted=True, chunks_removed=count)
 
@@ -124,8 +180,13 @@ async def delete_document(doc_id: str):
 async def query(req: QueryRequest):
     start = time.time()
 
-    query_vector = embedder.embed_text(req.query)
-    results = vector_store.search(query_vector, top_k=req.top_k)
+    query_vector = await embedder.embed_text_async(req.query)
+    results = await asyncio.to_thread(
+        vector_store.search,
+        query_vector,
+        top_k=req.top_k,
+        document_ids=req.document_ids,
+    )
 
     elapsed_ms = (time.time() - start) * 1000
     top_score = results[0]["score"] if results else 0.0
@@ -150,6 +211,7 @@ async def health():
         documents=stats["documents"],
         total_chunks=stats["total_chunks"],
         embedding_model=config.EMBEDDING_MODEL,
+        query_cache_hit_rate=round(embedder.get_query_cache_stats()["hit_rate"], 4),
         uptime_seconds=round(time.time() - _start_time, 1),
     )
 
@@ -159,3 +221,16 @@ def _get_file_size(doc_id: str, filename: str) -> int:
     if os.path.exists(path):
         return os.path.getsize(path)
     return 0
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=config.PORT,
+        workers=config.WORKERS,
+        loop="uvloop",
+        http="httptools",
+    )
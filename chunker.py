@@ -1,10 +1,13 @@
+import os
+from bisect import bisect_left, bisect_right
+
 import tiktoken
 
 _encoder = tiktoken.get_encoding("cl100k_base")
 
-
-def _token_count(text: str) -> int:
-    return len(_encoder.encode(text))
+# Texts at least this long (chars) are tokenized as parallel segments
+_PARALLEL_MIN_CHARS = 200_000
+_NUM_THREADS = os.cpu_count() or 1
 
 
 def chunk_text(
@@ -13,74 +16,153 @@ def chunk_text(
     chunk_overlap: int = 50,
     separators: list[str] | None = None,
 ) -> list[str]:
-    """Split text into chunks of approximately chunk_size tokens with overlap."""
+    """Split text into chunks of approximately chunk_size tokens with overlap.
+
+    The text is tokenized once. Splitting works on character spans of the
+    original text, and the token count of a span is read off the token offset
+    table, so tokenizer work stays linear in the document length.
+    """
     text = text.strip()
     if not text:
         return []
 
-    if _token_count(text) <= chunk_size:
+    token_starts = _token_starts(text)
+    if len(token_starts) <= chunk_size:
         return [text]
 
     if separators is None:
         separators = ["\n\n", "\n", ". ", " ", ""]
 
-    return _recursive_split(text, separators, chunk_size, chunk_overlap)
+    def span_tokens(start: int, end: int) -> int:
+        """Number of tokens overlapping text[start:end]."""
+        return bisect_left(token_starts, end) - bisect_right(token_starts, start) + 1
+
+    spans = _recursive_split(text, 0, len(text), separators, chunk_size, span_tokens)
+
+    # Apply overlap: prepend tail of previous chunk to each subsequent chunk
+    if chunk_overlap > 0 and len(spans) > 1:
+        return _apply_overlap(text, spans, token_starts, chunk_overlap)
+
+    return [text[start:end] for start, end in spans]
+
+
+def _token_starts(text: str) -> list[int]:
+    """Tokenize text and return the character offset at which each token starts.
+
+    Uses encode_ordinary (documents are plain text, so no special-token scan).
+    Long texts are cut at paragraph breaks into one segment per core and
+    encoded with encode_ordinary_batch, which runs on parallel Rust threads.
+    """
+    if len(text) >= _PARALLEL_MIN_CHARS and _NUM_THREADS > 1:
+        segments = _split_segments(text, _NUM_THREADS)
+    else:
+        segments = [text]
+
+    batch_ids = _encoder.encode_ordinary_batch(segments, num_threads=_NUM_THREADS)
+
+    starts = []
+    base = 0
+    for segment, ids in zip(segments, batch_ids):
+        _, offsets = _encoder.decode_with_offsets(ids)
+        starts.extend(base + offset for offset in offsets)
+        base += len(segment)
+    return starts
+
+
+def _split_segments(text: str, count: int) -> list[str]:
+    """Cut text into about `count` contiguous segments at paragraph breaks."""
+    target = len(text) // count
+    segments = []
+    start = 0
+    while len(segments) < count - 1:
+        cut = text.find("\n\n", start + target)
+        if cut == -1:
+            break
+        segments.append(text[start:cut])
+        start = cut
+    segments.append(text[start:])
+    return segments
+
+
+def _strip_span(text: str, start: int, end: int) -> tuple[int, int]:
+    """Span equivalent of str.strip() on text[start:end]."""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
 
 
 def _recursive_split(
     text: str,
+    start: int,
+    end: int,
     separators: list[str],
     chunk_size: int,
-    chunk_overlap: int,
-) -> list[str]:
-    """Recursively split text using separator hierarchy."""
+    span_tokens,
+) -> list[tuple[int, int]]:
+    """Recursively split text[start:end] using separator hierarchy.
+
+    Returns (start, end) character spans into text.
+    """
     sep = separators[0]
     remaining_seps = separators[1:]
 
     # Split on current separator
     if sep == "":
-        pieces = list(text)
+        pieces = [(i, i + 1) for i in range(start, end)]
     else:
-        pieces = text.split(sep)
+        pieces = []
+        pos = start
+        while (idx := text.find(sep, pos, end)) != -1:
+            pieces.append((pos, idx))
+            pos = idx + len(sep)
+        pieces.append((pos, end))
 
     # Merge pieces into chunks that fit within chunk_size
     chunks = []
-    current = ""
+    current = None
 
     for piece in pieces:
-        candidate = (current + sep + piece).strip() if current else piece.strip()
+        piece_start, piece_end = _strip_span(text, *piece)
+        if piece_start == piece_end:
+            continue
+        candidate = (current[0], piece_end) if current else (piece_start, piece_end)
 
-        if _token_count(candidate) <= chunk_size:
+        if span_tokens(*candidate) <= chunk_size:
             current = candidate
         else:
             if current:
                 chunks.append(current)
             # If the piece itself is too big, split it with next separator
-            if _token_count(piece.strip()) > chunk_size and remaining_seps:
-                sub_chunks = _recursive_split(
-                    piece.strip(), remaining_seps, chunk_size, chunk_overlap
-                )
-                chunks.extend(sub_chunks)
-                current = ""
+            if span_tokens(piece_start, piece_end) > chunk_size and remaining_seps:
+                chunks.extend(_recursive_split(
+                    text, piece_start, piece_end, remaining_seps, chunk_size, span_tokens
+                ))
+                current = None
             else:
-                current = piece.strip()
+                current = (piece_start, piece_end)
 
     if current:
         chunks.append(current)
 
-    # Apply overlap: prepend tail of previous chunk to each subsequent chunk
-    if chunk_overlap > 0 and len(chunks) > 1:
-        chunks = _apply_overlap(chunks, chunk_overlap)
-
     return chunks
 
 
-def _apply_overlap(chunks: list[str], overlap_tokens: int) -> list[str]:
+def _apply_overlap(
+    text: str,
+    spans: list[tuple[int, int]],
+    token_starts: list[int],
+    overlap_tokens: int,
+) -> list[str]:
     """Add overlap by prepending the tail of each chunk to the next."""
-    result = [chunks[0]]
-    for i in range(1, len(chunks)):
-        prev_tokens = _encoder.encode(chunks[i - 1])
-        overlap_text = _encoder.decode(prev_tokens[-overlap_tokens:])
-        merged = (overlap_text + " " + chunks[i]).strip()
+    result = [text[spans[0][0]:spans[0][1]]]
+    for (prev_start, prev_end), (start, end) in zip(spans, spans[1:]):
+        first = bisect_left(token_starts, prev_start)
+        last = bisect_left(token_starts, prev_end)
+        tail = max(first, last - overlap_tokens)
+        overlap_start = token_starts[tail] if tail < last else prev_end
+        overlap_text = text[max(overlap_start, prev_start):prev_end]
+        merged = (overlap_text + " " + text[start:end]).strip()
         result.append(merged)
     return result
@@ -1,9 +1,33 @@
 import os
 
 PORT = int(os.getenv("PORT", "8100"))
+# Uvicorn worker processes. Each worker loads its own model and has its own
+# embedding batcher and query cache, so a single worker batching concurrent
+# requests is usually the better use of the cores.
+WORKERS = int(os.getenv("WORKERS", "1"))
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-ai/nomic-embed-text-v1.5")
 LANCEDB_PATH = os.getenv("LANCEDB_PATH", "./data/lancedb")
 
+# "onnx" runs an INT8-quantized ONNX export of EMBEDDING_MODEL (exported once
+# into ONNX_CACHE_PATH); "torch" runs sentence-transformers directly.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+ONNX_CACHE_PATH = os.getenv("ONNX_CACHE_PATH", "./data/onnx")
+ONNX_PROVIDERS = [
+    p.strip()
+    for p in os.getenv("ONNX_PROVIDERS", "CPUExecutionProvider").split(",")
+    if p.strip()
+]
+
+# Concurrent requests are embedded together: the batchers wait up to
+# EMBED_BATCH_WINDOW_MS for more work, taking up to EMBED_MAX_BATCH queries or
+# INGEST_MAX_BATCH document chunks (across uploads) per encode call.
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", "256"))
+
+# Query embeddings kept in the LRU cache (0 disables it)
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+
 # Models that require task-specific prefixes for queries vs documents.
 # Keys are substrings matched against the model name.
 TASK_PREFIX_MODELS: dict[str, tuple[str, str]] = {
@@ -14,6 +38,18 @@ CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
 MAX_UPLOAD_SIZE_MB = int(os.getenv("MAX_UPLOAD_SIZE_MB", "50"))
 TOP_K_DEFAULT = int(os.getenv("TOP_K_DEFAULT", "5"))
+
+# ANN index on the vector column. Below ANN_INDEX_MIN_ROWS chunks a
+# brute-force scan is exact and fast enough, so no index is built. Once built,
+# the index is rebuilt each time the table doubles in size.
+ANN_INDEX_MIN_ROWS = int(os.getenv("ANN_INDEX_MIN_ROWS", "5000"))
+# IVF_SQ stores vectors as int8 in the index (4x less data per scan than
+# FP32); IVF_PQ compresses further at a larger recall cost
+ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "IVF_SQ").upper()
+IVF_LISTS = int(os.getenv("IVF_LISTS", "0"))  # 0 = sqrt(row count)
+IVF_NPROBES = int(os.getenv("IVF_NPROBES", "20"))
+# Re-rank refine_factor * top_k quantized candidates on full FP32 vectors (0 = off)
+ANN_REFINE_FACTOR = int(os.getenv("ANN_REFINE_FACTOR", "5"))
 LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
 
 SUPPORTED_EXTENSIONS = {".pdf", ".md", ".txt", ".docx", ".html"}
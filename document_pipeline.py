@@ -1,12 +1,15 @@
 import os
 import uuid
 import shutil
+from bisect import bisect_right
 from datetime import datetime, timezone
+from itertools import accumulate
+
+import numpy as np
 
 import config
 from parsers import parse_file
 from chunker import chunk_text
-from embedder import embed_batch
 from vector_store import insert_chunks
 
 
@@ -15,15 +18,15 @@ def generate_doc_id() -> str:
     return "doc_" + uuid.uuid4().hex[:8]
 
 
-def ingest_file(filepath: str, original_filename: str) -> dict:
-    """Ingest a single file: parse, chunk, embed, store.
+def prepare_document(filepath: str, original_filename: str) -> dict:
+    """Save, parse and chunk a file -- everything before embedding.
 
-    Args:
-        filepath: Path to the uploaded temp file
-        original_filename: Original name of the uploaded file
+    Embedding is left to the caller so chunks from several uploads can be
+    embedded in one batch (see embedder.embed_batch_async).
 
     Returns:
-        dict with id, filename, chunks count, status, file_size_bytes
+        dict with id, filename, file_size_bytes, indexed_at, chunks (list of
+        chunk texts) and page_numbers
     """
     doc_id = generate_doc_id()
     now = datetime.now(timezone.utc).isoformat()
@@ -44,50 +47,79 @@ def ingest_file(filepath: str, original_filename: str) -> dict:
     # Chunk
     chunks = chunk_text(text, chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP)
 
-    if not chunks:
-        return {
-            "id": doc_id,
-            "filename": original_filename,
-            "chunks": 0,
-            "status": "empty",
-            "file_size_bytes": file_size,
-        }
-
-    # Embed
-    vectors = embed_batch(chunks)
-
-    # Build records for vector store
-    records = []
-    for i, (chunk, vector) in enumerate(zip(chunks, vectors)):
-        page_number = _find_page_number(chunk, pages) if pages else 0
-        records.append({
-            "id": f"{doc_id}_{i}",
-            "document_id": doc_id,
-            "filename": original_filename,
-            "chunk_index": i,
-            "text": chunk,
-            "vector": vector,
-            "page_number": page_number,
-            "indexed_at": now,
-        })
-
-    # Store
-    insert_chunks(records)
+    # Page of origin for each chunk (PDFs only)
+    page_numbers = _find_page_numbers(text, chunks, pages) if pages else [0] * len(chunks)
 
     return {
         "id": doc_id,
         "filename": original_filename,
-        "chunks": len(records),
-        "status": "indexed",
         "file_size_bytes": file_size,
+        "indexed_at": now,
+        "chunks": chunks,
+        "page_numbers": page_numbers,
     }
 
 
-def _find_page_number(chunk: str, pages: list[dict] | None) -> int:
-    """Find which page a chunk most likely came from."""
-    if not pages:
-        return 0
-    for page in pages:
-        if chunk[:100] in page["text"]:
-            return page["page_number"]
+def store_document(prepared: dict, vectors: np.ndarray | None) -> dict:
+    """Write a prepared document's chunks and their vectors to the store.
+
+    Returns:
+        dict with id, filename, chunks count, status, file_size_bytes
+    """
+    chunks = prepared["chunks"]
+    result = {
+        "id": prepared["id"],
+        "filename": prepared["filename"],
+        "chunks": len(chunks),
+        "status": "indexed" if chunks else "empty",
+        "file_size_bytes": prepared["file_size_bytes"],
+    }
+    if not chunks:
+        return result
+
+    # Store
+    insert_chunks(
+        prepared["id"],
+        prepared["filename"],
+        chunks,
+        vectors,
+        prepared["page_numbers"],
+        prepared["indexed_at"],
+    )
+    return result
+
+
+def _find_page_numbers(text: str, chunks: list[str], pages: list[dict]) -> list[int]:
+    """Find which page each chunk most likely came from.
+
+    The parsed text is the pages joined with "\n\n" (see parsers._parse_pdf),
+    so page boundaries are cumulative character offsets. Chunks are in
+    document order, so each one is located with a forward find() from the
+    previous chunk's position and mapped to a page by bisecting the offsets.
+    The probe skips any overlap copied from the previous chunk, so a chunk is
+    attributed to the page where its own text starts.
+    """
+    page_ends = list(accumulate(len(page["text"]) + 2 for page in pages))
+    page_numbers = []
+    pos = 0
+    prev = ""
+    for chunk in chunks:
+        probe = chunk[_overlap_length(prev, chunk):].lstrip()[:80] or chunk[:80]
+        found = text.find(probe, pos)
+        if found != -1:
+            pos = found
+        page_index = min(bisect_right(page_ends, pos), len(pages) - 1)
+        page_numbers.append(pages[page_index]["page_number"])
+        prev = chunk
+    return page_numbers
+
+
+def _overlap_length(prev: str, chunk: str) -> int:
+    """Length of the prefix of chunk that repeats the end of prev (chunk overlap)."""
+    head = chunk[:16]
+    start = prev.find(head) if head else -1
+    while start != -1:
+        if chunk.startswith(prev[start:]):
+            return len(prev) - start
+        start = prev.find(head, start + 1)
     return 0
@@ -1,8 +1,208 @@
-from sentence_transformers import SentenceTransformer
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
 
 import config
 
-_model: SentenceTransformer | None = None
+# sentence_transformers (and with it torch) is imported inside load_model(), so
+# importing this module -- and app.py -- stays cheap until startup.
+
+__all__ = [
+    "load_model",
+    "get_model",
+    "get_query_cache_stats",
+    "embed_text",
+    "embed_queries",
+    "embed_batch",
+    "get_embedding_dimension",
+    "start_batchers",
+    "stop_batchers",
+    "embed_text_async",
+    "embed_batch_async",
+]
+
+logger = logging.getLogger(__name__)
+
+# SentenceTransformer (torch backend) or _OnnxModel (onnx backend). Both expose
+# encode() and get_sentence_embedding_dimension().
+_model = None
+_dim: int | None = None  # embedding dimension, read once in load_model()
+
+# Task prefixes for the loaded model, resolved once in load_model()
+_query_prefix = ""
+_doc_prefix = ""
+
+# LRU cache of query embeddings, keyed by a hash of (model, prefix, text)
+_query_cache: OrderedDict[bytes, list[float]] = OrderedDict()
+_query_cache_lock = threading.Lock()
+_query_cache_hits = 0
+_query_cache_misses = 0
+
+# Dynamic batching of concurrent requests (see start_batchers)
+_query_batcher = None
+_ingest_batcher = None
+
+# Written into the ONNX export directory when the export fails
+_EXPORT_FAILED_FILE = "EXPORT_FAILED"
+
+
+class _OnnxModel:
+    """INT8-quantized ONNX Runtime encoder.
+
+    Wraps an (InferenceSession, tokenizer) pair behind the subset of the
+    SentenceTransformer API this module uses. Pooling is a mean over the
+    attention mask; models configured otherwise are never exported (see
+    _check_onnx_compatible).
+    """
+
+    def __init__(self, session, tokenizer, prompts: tuple[str, ...] = ()):
+        self.session = session
+        self.tokenizer = tokenizer
+        self._input_names = [i.name for i in session.get_inputs()]
+        # Token ids of the task prefixes, so they are never re-tokenized
+        self._prompt_ids = {
+            prompt: tokenizer.encode(prompt, add_special_tokens=False)
+            for prompt in prompts
+            if prompt
+        }
+
+        # Special tokens the tokenizer wraps around a sequence, e.g. [CLS] ... [SEP]
+        sample = tokenizer("a", return_special_tokens_mask=True)
+        mask = sample["special_tokens_mask"]
+        first, last = mask.index(0), len(mask) - mask[::-1].index(0)
+        self._lead_ids = sample["input_ids"][:first]
+        self._trail_ids = sample["input_ids"][last:]
+
+    def encode(
+        self,
+        sentences,
+        prompt: str | None = None,
+        normalize_embeddings: bool = False,
+        batch_size: int = 32,
+    ):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        batches = [
+            self._encode_batch(texts[i:i + batch_size], prompt, normalize_embeddings)
+            for i in range(0, len(texts), batch_size)
+        ]
+        if not batches:
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        vectors = np.concatenate(batches)
+        return vectors[0] if single else vectors
+
+    def _tokenize(self, texts: list[str], prompt: str | None) -> dict[str, np.ndarray]:
+        """Tokenize texts into padded input_ids/attention_mask arrays.
+
+        The prompt's ids (precomputed for the task prefixes, cached on first
+        use otherwise) are spliced in after the leading special tokens,
+        instead of concatenating the prompt onto every text and tokenizing it
+        again.
+        """
+        if prompt and prompt not in self._prompt_ids:
+            self._prompt_ids[prompt] = self.tokenizer.encode(prompt, add_special_tokens=False)
+        prompt_ids = self._prompt_ids[prompt] if prompt else []
+
+        max_text_tokens = (
+            self.tokenizer.model_max_length
+            - len(self._lead_ids) - len(self._trail_ids) - len(prompt_ids)
+        )
+        rows = [
+            self._lead_ids + prompt_ids + ids[:max_text_tokens] + self._trail_ids
+            for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+        ]
+
+        width = max(len(row) for row in rows)
+        input_ids = np.full((len(rows), width), self.tokenizer.pad_token_id or 0, dtype=np.int64)
+        attention_mask = np.zeros((len(rows), width), dtype=np.int64)
+        for i, row in enumerate(rows):
+            input_ids[i, :len(row)] = row
+            attention_mask[i, :len(row)] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+    def _encode_batch(self, texts: list[str], prompt: str | None, normalize: bool) -> np.ndarray:
+        encoded = self._tokenize(texts, prompt)
+        # Single-segment input: models that take token_type_ids get all zeros
+        encoded["token_type_ids"] = np.zeros_like(encoded["input_ids"])
+        feed = {name: encoded[name] for name in self._input_names}
+        (hidden,) = self.session.run(["last_hidden_state"], feed)
+
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if normalize:
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.session.get_outputs()[0].shape[-1]
+
+
+class _Batcher:
+    """Coalesces concurrent embedding requests into single embed_fn calls.
+
+    Callers submit lists of texts. A background task collects requests for up
+    to EMBED_BATCH_WINDOW_MS, or until max_items texts are queued (one large
+    request may overshoot), runs embed_fn once on a worker thread and hands
+    each caller its slice of the result.
+    """
+
+    def __init__(self, embed_fn, max_items: int):
+        self.embed_fn = embed_fn
+        self.max_items = max_items
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def submit(self, texts: list[str]):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    async def close(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        window = config.EMBED_BATCH_WINDOW_MS / 1000
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + window
+            while size < self.max_items:
+                remaining = deadline - loop.time()
+                try:
+                    if remaining <= 0:
+                        item = self.queue.get_nowait()
+                    else:
+                        item = await asyncio.wait_for(self.queue.get(), remaining)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                vectors = await asyncio.to_thread(self.embed_fn, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
 
 
 def _get_task_prefixes() -> tuple[str, str]:
@@ -18,41 +218,261 @@ def _get_task_prefixes() -> tuple[str, str]:
     return ("", "")
 
 
-def load_model() -> SentenceTransformer:
-    """Load the embedding model. Called once at startup."""
-    global _model
+def _onnx_export_dir() -> str:
+    return os.path.join(config.ONNX_CACHE_PATH, config.EMBEDDING_MODEL.replace("/", "__"))
+
+
+def _sentence_transformers_dir() -> str:
+    """Local directory holding the model's sentence-transformers config files."""
+    if os.path.isdir(config.EMBEDDING_MODEL):
+        return config.EMBEDDING_MODEL
+    from huggingface_hub import snapshot_download
+
+    return snapshot_download(
+        config.EMBEDDING_MODEL, allow_patterns=["modules.json", "*/config.json"]
+    )
+
+
+def _check_onnx_compatible(model_dir: str):
+    """Raise ValueError unless _OnnxModel reproduces the model's pipeline.
+
+    _OnnxModel implements Transformer -> masked mean pooling (-> Normalize).
+    Other pooling modes or extra modules (Dense, LayerNorm, ...) would give
+    silently wrong vectors, so those models stay on sentence-transformers.
+    """
+    modules_path = os.path.join(model_dir, "modules.json")
+    if not os.path.exists(modules_path):
+        return  # plain transformers model: sentence-transformers mean-pools it
+    with open(modules_path) as f:
+        modules = json.load(f)
+
+    for module in modules:
+        kind = module["type"].rsplit(".", 1)[-1]
+        if kind not in ("Transformer", "Pooling", "Normalize"):
+            raise ValueError(f"{kind} module is not supported by the ONNX backend")
+        if kind == "Pooling":
+            with open(os.path.join(model_dir, module["path"], "config.json")) as f:
+                pooling = json.load(f)
+            modes = [k for k, v in pooling.items() if k.startswith("pooling_mode_") and v]
+            if modes != ["pooling_mode_mean_tokens"]:
+                raise ValueError(f"pooling {modes} is not supported by the ONNX backend")
+
+
+def _export_quantized_onnx(export_dir: str):
+    """Export the model to ONNX and write a dynamically quantized INT8 copy.
+
+    Runs once per model; the result is cached under config.ONNX_CACHE_PATH.
+    """
+    _check_onnx_compatible(_sentence_transformers_dir())
+
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    logger.info("Exporting %s to ONNX (one-time)", config.EMBEDDING_MODEL)
+    ort_model = ORTModelForFeatureExtraction.from_pretrained(
+        config.EMBEDDING_MODEL, export=True, trust_remote_code=True
+    )
+    ort_model.save_pretrained(export_dir)
+    tokenizer = AutoTokenizer.from_pretrained(config.EMBEDDING_MODEL, trust_remote_code=True)
+    tokenizer.save_pretrained(export_dir)
+
+    quantizer = ORTQuantizer.from_pretrained(export_dir, file_name="model.onnx")
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=export_dir, quantization_config=qconfig)
+
+
+def _load_onnx_model() -> _OnnxModel:
+    import onnxruntime
+    from transformers import AutoTokenizer
+
+    export_dir = _onnx_export_dir()
+    model_path = os.path.join(export_dir, "model_quantized.onnx")
+    failed_marker = os.path.join(export_dir, _EXPORT_FAILED_FILE)
+    if os.path.exists(failed_marker):
+        # Don't re-run a failed export (which loads the torch model) on every start
+        with open(failed_marker) as f:
+            reason = f.read().strip()
+        raise RuntimeError(f"export failed earlier (delete {failed_marker} to retry): {reason}")
+    if not os.path.exists(model_path):
+        try:
+            _export_quantized_onnx(export_dir)
+        except Exception as e:
+            os.makedirs(export_dir, exist_ok=True)
+            with open(failed_marker, "w") as f:
+                f.write(f"{type(e).__name__}: {e}\n")
+            raise
+
+    session = onnxruntime.InferenceSession(model_path, providers=config.ONNX_PROVIDERS)
+    tokenizer = AutoTokenizer.from_pretrained(export_dir)
+    return _OnnxModel(session, tokenizer, prompts=(_query_prefix, _doc_prefix))
+
+
+def load_model():
+    """Load the embedding model. Called once at startup.
+
+    With EMBEDDING_BACKEND=onnx (the default) this loads the INT8 ONNX export,
+    creating it on first use. If the export or session fails (e.g. the model
+    architecture has no ONNX export config), falls back to sentence-transformers.
+    """
+    global _model, _dim, _query_prefix, _doc_prefix
     if _model is None:
-        _model = SentenceTransformer(
-            config.EMBEDDING_MODEL, trust_remote_code=True
-        )
+        _query_prefix, _doc_prefix = _get_task_prefixes()
+        if config.EMBEDDING_BACKEND == "onnx":
+            try:
+                _model = _load_onnx_model()
+            except Exception as e:
+                logger.warning(
+                    "ONNX backend unavailable for %s, using sentence-transformers: %s",
+                    config.EMBEDDING_MODEL, e,
+                )
+        if _model is None:
+            from sentence_transformers import SentenceTransformer
+
+            _model = SentenceTransformer(
+                config.EMBEDDING_MODEL, trust_remote_code=True
+            )
+        _dim = _model.get_sentence_embedding_dimension()
     return _model
 
 
-def get_model() -> SentenceTransformer:
+def get_model():
     """Get the loaded model. Raises if not loaded yet."""
     if _model is None:
         raise RuntimeError("Embedding model not loaded. Call load_model() first.")
     return _model
 
 
+def _query_cache_key(text: str) -> bytes:
+    key = f"{config.EMBEDDING_MODEL}\0{_query_prefix}\0{text}"
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+
+def _query_cache_get(key: bytes) -> list[float] | None:
+    global _query_cache_hits, _query_cache_misses
+    with _query_cache_lock:
+        vector = _query_cache.get(key)
+        if vector is None:
+            _query_cache_misses += 1
+        else:
+            _query_cache_hits += 1
+            _query_cache.move_to_end(key)
+        return vector
+
+
+def _query_cache_put(key: bytes, vector: list[float]):
+    if config.EMBED_CACHE_SIZE <= 0:
+        return
+    with _query_cache_lock:
+        _query_cache[key] = vector
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > config.EMBED_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+
+
+def get_query_cache_stats() -> dict:
+    """Return size, hits, misses and hit_rate of the query embedding cache."""
+    with _query_cache_lock:
+        lookups = _query_cache_hits + _query_cache_misses
+        return {
+            "size": len(_query_cache),
+            "hits": _query_cache_hits,
+            "misses": _query_cache_misses,
+            "hit_rate": _query_cache_hits / lookups if lookups else 0.0,
+        }
+
+
 def embed_text(text: str) -> list[float]:
-    """Embed a single text string. Used for queries."""
-    model = get_model()
-    query_prefix, _ = _get_task_prefixes()
-    vector = model.encode(query_prefix + text, normalize_embeddings=True)
-    return vector.tolist()
+    """Embed a single text string. Used for queries.
 
+    Results are cached (LRU, EMBED_CACHE_SIZE entries), so a repeated query
+    skips the forward pass.
+    """
+    key = _query_cache_key(text)
+    vector = _query_cache_get(key)
+    if vector is None:
+        model = get_model()
+        encoded = model.encode(text, prompt=_query_prefix or None, normalize_embeddings=True)
+        vector = encoded.tolist()
+        _query_cache_put(key, vector)
+    return vector
 
-def embed_batch(texts: list[str]) -> list[list[float]]:
-    """Embed a batch of texts. Used for document ingestion."""
+
+def embed_queries(texts: list[str]) -> list[list[float]]:
+    """Embed several queries in a single forward pass."""
     model = get_model()
-    _, doc_prefix = _get_task_prefixes()
-    prefixed = [doc_prefix + t for t in texts]
-    vectors = model.encode(prefixed, normalize_embeddings=True, batch_size=64)
+    vectors = model.encode(
+        texts,
+        prompt=_query_prefix or None,
+        normalize_embeddings=True,
+        batch_size=len(texts),
+    )
     return vectors.tolist()
 
 
-def get_embedding_dimension() -> int:
-    """Return the dimension of the embedding vectors."""
+def embed_batch(texts: list[str]) -> np.ndarray:
+    """Embed a batch of texts. Used for document ingestion.
+
+    Returns a (len(texts), dim) float32 array, which the vector store turns
+    into an Arrow column without a per-row Python list.
+    """
     model = get_model()
-    return model.get_sentence_embedding_dimension()
+    return model.encode(
+        texts, prompt=_doc_prefix or None, normalize_embeddings=True, batch_size=64
+    )
+
+
+def get_embedding_dimension() -> int:
+    """Return the dimension of the embedding vectors (cached at load time)."""
+    if _dim is None:
+        get_model()  # raises: model not loaded
+    return _dim
+
+
+def start_batchers():
+    """Start the background tasks that batch concurrent query embeddings and
+    document chunks (across uploads).
+
+    Must be called from the running event loop (app startup).
+    """
+    global _query_batcher, _ingest_batcher
+    if _query_batcher is None:
+        _query_batcher = _Batcher(embed_queries, config.EMBED_MAX_BATCH)
+        _ingest_batcher = _Batcher(embed_batch, config.INGEST_MAX_BATCH)
+
+
+async def stop_batchers():
+    """Cancel the batching tasks. Called at app shutdown."""
+    global _query_batcher, _ingest_batcher
+    for batcher in (_query_batcher, _ingest_batcher):
+        if batcher is not None:
+            await batcher.close()
+    _query_batcher = None
+    _ingest_batcher = None
+
+
+async def embed_text_async(text: str) -> list[float]:
+    """Embed a query, batched with other queries arriving at the same time.
+
+    Checks the query cache first, like embed_text. Falls back to embedding on
+    a worker thread when the batchers aren't running.
+    """
+    if _query_batcher is None:
+        return await asyncio.to_thread(embed_text, text)
+
+    key = _query_cache_key(text)
+    vector = _query_cache_get(key)
+    if vector is None:
+        (vector,) = await _query_batcher.submit([text])
+        _query_cache_put(key, vector)
+    return vector
+
+
+async def embed_batch_async(texts: list[str]) -> np.ndarray:
+    """Embed document chunks, batched with chunks from concurrent uploads.
+
+    Falls back to embedding on a worker thread when the batchers aren't running.
+    """
+    if _ingest_batcher is None:
+        return await asyncio.to_thread(embed_batch, texts)
+    return await _ingest_batcher.submit(texts)
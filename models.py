@@ -4,6 +4,7 @@ from pydantic import BaseModel, Field
 class QueryRequest(BaseModel):
     query: str
     top_k: int = Field(default=5, ge=1, le=50)
+    document_ids: list[str] | None = None
 
 
 class QueryResult(BaseModel):
@@ -54,4 +55,5 @@ class HealthResponse(BaseModel):
     documents: int
     total_chunks: int
     embedding_model: str
+    query_cache_hit_rate: float
     uptime_seconds: float
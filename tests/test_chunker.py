@@ -41,3 +41,15 @@ def test_empty_text():
 def test_whitespace_only():
     """Whitespace-only text returns empty list."""
     assert chunk_text("   \n\n  ", chunk_size=500, chunk_overlap=50) == []
+
+
+def test_chunks_cover_source_without_overlap():
+    """Without overlap, chunks are verbatim slices that together cover the text."""
+    text = "\n\n".join(
+        "\n".join(f"para{p} line{n} some filler words" for n in range(20))
+        for p in range(10)
+    )
+    chunks = chunk_text(text, chunk_size=80, chunk_overlap=0)
+    assert len(chunks) > 1
+    assert all(chunk in text for chunk in chunks)
+    assert " ".join(chunks).split() == text.split()
@@ -0,0 +1,41 @@
+import pytest
+from chunker import chunk_text
+from document_pipeline import _find_page_numbers
+
+
+def _make_pages(num_pages: int, words_per_page: int) -> list[dict]:
+    """Pages of unique words, e.g. "p2w17" is word 17 on page 2."""
+    return [
+        {
+            "page_number": page,
+            "text": " ".join(f"p{page}w{word}" for word in range(words_per_page)),
+        }
+        for page in range(1, num_pages + 1)
+    ]
+
+
+def _page_of(word: str) -> int:
+    return int(word[1:word.index("w")])
+
+
+@pytest.mark.parametrize("overlap", [0, 20])
+def test_find_page_numbers_uses_own_text(overlap):
+    """Each chunk maps to the page where its own (non-overlap) text starts."""
+    pages = _make_pages(num_pages=6, words_per_page=120)
+    text = "\n\n".join(page["text"] for page in pages)  # as parsers._parse_pdf joins
+    words = text.split()
+    chunks = chunk_text(text, chunk_size=100, chunk_overlap=overlap)
+    assert len(chunks) > len(pages)
+
+    expected = [_page_of(chunks[0].split()[0])]
+    for prev, chunk in zip(chunks, chunks[1:]):
+        # Own text starts right after the previous chunk's last word
+        first_own_word = words[words.index(prev.split()[-1]) + 1]
+        expected.append(_page_of(first_own_word))
+
+    assert _find_page_numbers(text, chunks, pages) == expected
+
+
+def test_find_page_numbers_single_page():
+    pages = [{"page_number": 1, "text": "only page text"}]
+    assert _find_page_numbers("only page text", ["only page text"], pages) == [1]
@@ -0,0 +1,125 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import config
+import embedder
+
+TINY_MODEL = "sentence-transformers-testing/stsb-bert-tiny-safetensors"
+QUERY_PREFIX = "search_query: "
+TEXTS = ["hello world", "the quick brown fox jumps over the lazy dog", "foo"]
+
+
+def _write_st_config(path, pooling_modes, extra_modules=()):
+    modules = [
+        {"idx": 0, "name": "0", "path": "", "type": "sentence_transformers.models.Transformer"},
+        {"idx": 1, "name": "1", "path": "1_Pooling", "type": "sentence_transformers.models.Pooling"},
+    ]
+    for i, kind in enumerate(extra_modules, start=2):
+        modules.append({"idx": i, "name": str(i), "path": f"{i}_{kind}",
+                        "type": f"sentence_transformers.models.{kind}"})
+    (path / "modules.json").write_text(json.dumps(modules))
+    (path / "1_Pooling").mkdir()
+    pooling = {"word_embedding_dimension": 8}
+    for mode in ("cls_token", "mean_tokens", "max_tokens", "lasttoken"):
+        pooling[f"pooling_mode_{mode}"] = mode in pooling_modes
+    (path / "1_Pooling" / "config.json").write_text(json.dumps(pooling))
+
+
+def test_onnx_compatible_accepts_mean_pooling(tmp_path):
+    _write_st_config(tmp_path, {"mean_tokens"}, extra_modules=["Normalize"])
+    embedder._check_onnx_compatible(str(tmp_path))
+
+
+@pytest.mark.parametrize(
+    "pooling_modes, extra_modules",
+    [({"cls_token"}, []), ({"lasttoken"}, []), ({"mean_tokens"}, ["Dense"])],
+)
+def test_onnx_compatible_rejects_other_pipelines(tmp_path, pooling_modes, extra_modules):
+    """Pipelines _OnnxModel can't reproduce are refused, not silently mis-pooled."""
+    _write_st_config(tmp_path, pooling_modes, extra_modules)
+    with pytest.raises(ValueError):
+        embedder._check_onnx_compatible(str(tmp_path))
+
+
+def test_failed_export_is_not_retried(tmp_path, monkeypatch):
+    """A failed export leaves a marker, so later startups skip straight to the fallback."""
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("transformers")
+    monkeypatch.setattr(config, "ONNX_CACHE_PATH", str(tmp_path))
+    calls = []
+
+    def failing_export(export_dir):
+        calls.append(export_dir)
+        raise ValueError("no ONNX config for this architecture")
+
+    monkeypatch.setattr(embedder, "_export_quantized_onnx", failing_export)
+    for _ in range(2):
+        with pytest.raises(Exception, match="no ONNX config"):
+            embedder._load_onnx_model()
+    assert len(calls) == 1
+
+
+def test_prompt_ids_spliced_like_concatenated_text(tmp_path):
+    """Splicing cached prompt ids gives the same input as tokenizing prompt + text."""
+    pytest.importorskip("onnx")
+    onnxruntime = pytest.importorskip("onnxruntime")
+    pytest.importorskip("transformers")
+    from onnx import TensorProto, helper, numpy_helper
+    from transformers import BertTokenizerFast
+
+    words = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "search", "_", "query", ":",
+             "hello", "world", "foo"]
+    (tmp_path / "vocab.txt").write_text("\n".join(words))
+    tokenizer = BertTokenizerFast(str(tmp_path / "vocab.txt"))
+
+    # "Model" whose hidden states are a per-token embedding lookup
+    table = np.random.RandomState(0).randn(len(words), 8).astype(np.float32)
+    graph = helper.make_graph(
+        [helper.make_node("Gather", ["table", "input_ids"], ["last_hidden_state"])],
+        "lookup",
+        [helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["b", "l"]),
+         helper.make_tensor_value_info("attention_mask", TensorProto.INT64, ["b", "l"])],
+        [helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, ["b", "l", 8])],
+        [numpy_helper.from_array(table, "table")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    session = onnxruntime.InferenceSession(
+        model.SerializeToString(), providers=["CPUExecutionProvider"]
+    )
+    encoder = embedder._OnnxModel(session, tokenizer, prompts=(QUERY_PREFIX,))
+
+    texts = ["hello world", "foo", "world hello foo"]
+    spliced = encoder._tokenize(texts, QUERY_PREFIX)
+    for row, mask, text in zip(spliced["input_ids"], spliced["attention_mask"], texts):
+        assert row[mask == 1].tolist() == tokenizer(QUERY_PREFIX + text)["input_ids"]
+
+    vectors = encoder.encode(texts, prompt=QUERY_PREFIX, normalize_embeddings=True)
+    for vector, text in zip(vectors, texts):
+        expected = table[tokenizer(QUERY_PREFIX + text)["input_ids"]].mean(axis=0)
+        np.testing.assert_allclose(vector, expected / np.linalg.norm(expected), atol=1e-6)
+
+
+def test_onnx_matches_sentence_transformers(tmp_path, monkeypatch):
+    """The INT8 ONNX export embeds (with a task prefix) like the torch model."""
+    pytest.importorskip("torch")
+    pytest.importorskip("optimum.onnxruntime")
+    sentence_transformers = pytest.importorskip("sentence_transformers")
+
+    monkeypatch.setattr(config, "EMBEDDING_MODEL", TINY_MODEL)
+    monkeypatch.setattr(config, "ONNX_CACHE_PATH", str(tmp_path))
+    monkeypatch.setattr(embedder, "_query_prefix", QUERY_PREFIX)
+    onnx_model = embedder._load_onnx_model()
+    assert not os.path.exists(os.path.join(embedder._onnx_export_dir(), "EXPORT_FAILED"))
+
+    torch_model = sentence_transformers.SentenceTransformer(TINY_MODEL)
+    expected = torch_model.encode(TEXTS, prompt=QUERY_PREFIX, normalize_embeddings=True)
+    actual = onnx_model.encode(TEXTS, prompt=QUERY_PREFIX, normalize_embeddings=True)
+
+    assert actual.shape == expected.shape
+    # INT8 quantization perturbs the vectors slightly; direction must be kept
+    cosine = (actual * expected).sum(axis=1)
+    assert (cosine > 0.98).all()
@@ -1,17 +1,41 @@
+import fcntl
 import logging
+import math
 import os
-from datetime import datetime, timezone
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 
 import lancedb
+import numpy as np
 import pyarrow as pa
 
 import config
 import embedder
 
+__all__ = [
+    "init_store",
+    "insert_chunks",
+    "search",
+    "delete_document",
+    "list_documents",
+    "get_stats",
+]
+
 logger = logging.getLogger(__name__)
 
 _db = None
 _table = None
+_indexed_rows = 0  # row count when the ANN index was last built
+_id_indexed_rows = 0  # rows covered by the document_id index
+_index_lock = threading.Lock()
+
+# document_id -> {"filename", "chunks", "indexed_at"}. Loaded from the table in
+# init_store and kept current by insert_chunks/delete_document, so listing
+# documents and stats never scan the table.
+_doc_registry: dict[str, dict] = {}
+_registry_version = None  # table version the registry was last loaded from
+_registry_lock = threading.Lock()
 
 TABLE_NAME = "chunks"
 
@@ -37,16 +61,30 @@ def init_store():
     768-dim) and recreates the table automatically. The nightly cron will
     re-index all documents.
     """
-    global _db, _table
+    global _db, _indexed_rows, _id_indexed_rows
     os.makedirs(config.LANCEDB_PATH, exist_ok=True)
-    _db = lancedb.connect(config.LANCEDB_PATH)
+    # With several workers, check for other processes' writes on every read
+    consistency = timedelta(0) if config.WORKERS > 1 else None
+    _db = lancedb.connect(config.LANCEDB_PATH, read_consistency_interval=consistency)
 
     dim = embedder.get_embedding_dimension()
     schema = _build_schema(dim)
 
+    # Serialize startup across worker processes sharing the store
+    with _store_lock("init"):
+        _open_table(dim, schema)
+        _indexed_rows, _id_indexed_rows = _indexed_row_counts()
+
+    _load_registry()
+    _maybe_build_index()
+
+
+def _open_table(dim: int, schema: pa.Schema):
+    """Open the chunks table, (re)creating it if missing or of another dimension."""
+    global _table
     if TABLE_NAME in _db.table_names():
         existing = _db.open_table(TABLE_NAME)
-        existing_schema = existing.to_arrow().schema
+        existing_schema = existing.schema
         vec_field = existing_schema.field("vector")
         existing_dim = vec_field.type.list_size
         if existing_dim != dim:
@@ -61,93 +99,274 @@ def init_store():
         else:
             _table = existing
     else:
-        _table = _db.create_table(TABLE_NAME, schema=schema)
+        _table = _db.create_table(TABLE_NAME, schema=schema, exist_ok=True)
 
 
-def _get_table():
-    if _table is None:
-        raise RuntimeError("Vector store not initialized. Call init_store() first.")
-    return _table
+@contextmanager
+def _store_lock(name: str, blocking: bool = True):
+    """Exclusive file lock shared by all processes using the store.
+
+    Yields whether the lock was acquired (always True when blocking).
+    """
+    with open(os.path.join(config.LANCEDB_PATH, f".{name}.lock"), "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+        else:
+            yield True
 
 
-def insert_chunks(chunks: list[dict]):
-    """Insert a list of chunk dicts into the vector store.
+def _indexed_row_counts() -> tuple[int, int]:
+    """Rows covered by the (vector, document_id) indices.
 
-    Each dict must have: id, document_id, filename, chunk_index, text, vector,
-    page_number, indexed_at
+    Not the current row count: rows appended since the last build are
+    unindexed and count toward a rebuild.
     """
     table = _get_table()
-    table.add(chunks)
+    indices = {col: idx.name for idx in table.list_indices() for col in idx.columns}
+    return tuple(
+        table.index_stats(indices[col]).num_indexed_rows if col in indices else 0
+        for col in ("vector", "document_id")
+    )
+
+
+def _get_table():
+    if _table is None:
+        raise RuntimeError("Vector store not initialized. Call init_store() first.")
+    return _table
 
 
-def search(query_vector: list[float], top_k: int = 5) -> list[dict]:
-    """Search for similar vectors. Returns list of result dicts."""
+def insert_chunks(
+    document_id: str,
+    filename: str,
+    texts: list[str],
+    vectors: np.ndarray,
+    page_numbers: list[int],
+    indexed_at: str,
+):
+    """Insert one document's chunks into the vector store as one Arrow batch."""
+    table = _get_table()
+    num_chunks, dim = vectors.shape
+    flat_vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1)
+
+    batch = pa.RecordBatch.from_arrays(
+        [
+            pa.array([f"{document_id}_{i}" for i in range(num_chunks)], pa.string()),
+            pa.array([document_id] * num_chunks, pa.string()),
+            pa.array([filename] * num_chunks, pa.string()),
+            pa.array(range(num_chunks), pa.int32()),
+            pa.array(texts, pa.string()),
+            pa.FixedSizeListArray.from_arrays(pa.array(flat_vectors, pa.float32()), dim),
+            pa.array(page_numbers, pa.int32()),
+            pa.array([indexed_at] * num_chunks, pa.string()),
+        ],
+        schema=_build_schema(dim),
+    )
+    table.add(batch)
+    with _registry_lock:
+        entry = _doc_registry.setdefault(
+            document_id, {"filename": filename, "chunks": 0, "indexed_at": indexed_at}
+        )
+        entry["chunks"] += num_chunks
+    _maybe_build_index()
+
+
+def _maybe_build_index():
+    """Start a background build of whichever indices are due."""
+    num_rows = _get_table().count_rows()
+    if not (_ann_index_due(num_rows) or _id_index_due(num_rows)):
+        return
+    if not _index_lock.acquire(blocking=False):
+        return
+    threading.Thread(target=_build_indices, name="index-build", daemon=True).start()
+
+
+def _ann_index_due(num_rows: int) -> bool:
+    if num_rows < config.ANN_INDEX_MIN_ROWS:
+        return False
+    return not _indexed_rows or num_rows >= 2 * _indexed_rows
+
+
+def _id_index_due(num_rows: int) -> bool:
+    # Rebuilding the BTREE is cheap, so keep at most ~10% of rows unindexed
+    return num_rows - _id_indexed_rows > num_rows // 10
+
+
+def _build_indices():
+    global _indexed_rows, _id_indexed_rows
+    try:
+        # One build at a time across worker processes; the others skip it
+        with _store_lock("index", blocking=False) as acquired:
+            if not acquired:
+                return
+            # Pick up builds another worker finished since we last looked
+            ann_rows, id_rows = _indexed_row_counts()
+            _indexed_rows = max(_indexed_rows, ann_rows)
+            _id_indexed_rows = max(_id_indexed_rows, id_rows)
+            num_rows = _get_table().count_rows()
+            if _ann_index_due(num_rows):
+                _build_ann_index(num_rows)
+            if _id_index_due(num_rows):
+                _build_id_index(num_rows)
+    finally:
+        _index_lock.release()
+
+
+def _build_ann_index(num_rows: int):
+    global _indexed_rows
+    table = _get_table()
+    index_type = config.ANN_INDEX_TYPE
+    num_partitions = config.IVF_LISTS or max(1, int(math.sqrt(num_rows)))
+    kwargs = {}
+    if index_type == "IVF_PQ":
+        kwargs["num_sub_vectors"] = max(1, embedder.get_embedding_dimension() // 16)
+    try:
+        table.create_index(
+            metric="l2",
+            vector_column_name="vector",
+            index_type=index_type,
+            num_partitions=num_partitions,
+            replace=True,
+            **kwargs,
+        )
+    except Exception as e:
+        logger.warning("Failed to build ANN index, search stays brute-force: %s", e)
+    else:
+        logger.info(
+            "Built %s index (rows=%d, partitions=%d)",
+            index_type,
+            num_rows,
+            num_partitions,
+        )
+    # Also set on failure so a bad config doesn't retry on every insert.
+    _indexed_rows = num_rows
+
+
+def _build_id_index(num_rows: int):
+    """(Re)build the BTREE index that serves document_id filters."""
+    global _id_indexed_rows
+    try:
+        _get_table().create_scalar_index("document_id", index_type="BTREE", replace=True)
+    except Exception as e:
+        logger.warning("Failed to build document_id index: %s", e)
+    _id_indexed_rows = num_rows
+
+
+def _sql_literal(value: str) -> str:
+    """Quote a string for use in a LanceDB filter expression."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def search(
+    query_vector: list[float],
+    top_k: int = 5,
+    nprobes: int | None = None,
+    document_ids: list[str] | None = None,
+) -> list[dict]:
+    """Search for similar vectors, optionally within document_ids."""
     table = _get_table()
 
+    query = table.search(query_vector).nprobes(nprobes or config.IVF_NPROBES)
+    if config.ANN_REFINE_FACTOR > 0:
+        query = query.refine_factor(config.ANN_REFINE_FACTOR)
+    if document_ids is not None:
+        ids = ", ".join(_sql_literal(doc_id) for doc_id in document_ids) or "NULL"
+        query = query.where(f"document_id IN ({ids})", prefilter=True)
+
+    # Project only the returned columns -- never the vector
     results = (
-        table.search(query_vector)
+        query.select(["text", "document_id", "filename", "chunk_index", "_distance"])
         .limit(top_k)
-        .to_list()
+        .to_arrow()
     )
 
+    distances = results.column("_distance").to_numpy().astype(np.float64)
+    scores = np.round(1.0 / (1.0 + distances), 4).tolist()
+
     return [
         {
-            "text": r["text"],
-            "score": round(1.0 / (1.0 + r.get("_distance", 0.0)), 4),
-            "document_id": r["document_id"],
-            "filename": r["filename"],
-            "chunk_index": r["chunk_index"],
+            "text": text,
+            "score": score,
+            "document_id": document_id,
+            "filename": filename,
+            "chunk_index": chunk_index,
         }
-        for r in results
+        for text, score, document_id, filename, chunk_index in zip(
+            results.column("text").to_pylist(),
+            scores,
+            results.column("document_id").to_pylist(),
+            results.column("filename").to_pylist(),
+            results.column("chunk_index").to_pylist(),
+        )
     ]
 
 
 def delete_document(document_id: str) -> int:
     """Delete all chunks for a document. Returns count of removed chunks."""
     table = _get_table()
-    count = table.count_rows(f"document_id = '{document_id}'")
-    if count > 0:
-        table.delete(f"document_id = '{document_id}'")
-    return count
+    _sync_registry()
+    with _registry_lock:
+        entry = _doc_registry.get(document_id)
+    if entry is None:
+        return 0
+    # Forget the document only once its rows are actually gone
+    table.delete(f"document_id = {_sql_literal(document_id)}")
+    with _registry_lock:
+        _doc_registry.pop(document_id, None)
+    return entry["chunks"]
+
+
+def _scan_columns(columns: list[str]) -> pa.Table:
+    """Read only the given columns of every row (projection pushed down to LanceDB)."""
+    return _get_table().search().select(columns).limit(None).to_arrow()
+
+
+def _load_registry():
+    """Rebuild the document registry from the table's metadata columns."""
+    global _doc_registry, _registry_version
+    table = _get_table()
+    version = table.version
 
+    # Group by document_id in Arrow over the three metadata columns
+    grouped = (
+        _scan_columns(["document_id", "filename", "indexed_at"])
+        .group_by(["document_id", "filename"], use_threads=False)
+        .aggregate([("indexed_at", "min"), ("document_id", "count")])
+    )
+    registry = {
+        doc_id: {"filename": filename, "chunks": chunks, "indexed_at": indexed_at}
+        for doc_id, filename, chunks, indexed_at in zip(
+            grouped.column("document_id").to_pylist(),
+            grouped.column("filename").to_pylist(),
+            grouped.column("document_id_count").to_pylist(),
+            grouped.column("indexed_at_min").to_pylist(),
+        )
+    }
 
-def list_documents() -> list[dict]:
-    """List all unique documents in the store."""
-    table = _get_table()
+    with _registry_lock:
+        _doc_registry = registry
+        _registry_version = version
 
-    if table.count_rows() == 0:
-        return []
 
-    # Use PyArrow directly instead of pandas
-    arrow_table = table.to_arrow()
-    doc_ids = arrow_table.column("document_id").to_pylist()
-    filenames = arrow_table.column("filename").to_pylist()
-    indexed_ats = arrow_table.column("indexed_at").to_pylist()
+def _sync_registry():
+    """Reload the registry if another worker process has written to the table."""
+    if config.WORKERS > 1 and _get_table().version != _registry_version:
+        _load_registry()
 
-    # Group by document_id
-    doc_map: dict[str, dict] = {}
-    for doc_id, filename, indexed_at in zip(doc_ids, filenames, indexed_ats):
-        if doc_id not in doc_map:
-            doc_map[doc_id] = {
-                "id": doc_id,
-                "filename": filename,
-                "chunks": 0,
-                "indexed_at": indexed_at,
-            }
-        doc_map[doc_id]["chunks"] += 1
 
-    return list(doc_map.values())
+def list_documents() -> list[dict]:
+    """List all unique documents in the store."""
+    _sync_registry()
+    with _registry_lock:
+        return [{"id": doc_id, **entry} for doc_id, entry in _doc_registry.items()]
 
 
 def get_stats() -> dict:
     """Get store statistics."""
-    table = _get_table()
-    total_chunks = table.count_rows()
-
-    if total_chunks == 0:
-        return {"documents": 0, "total_chunks": 0}
-
-    # Use PyArrow directly instead of pandas
-    arrow_table = table.to_arrow()
-    unique_docs = len(set(arrow_table.column("document_id").to_pylist()))
-    return {"documents": unique_docs, "total_chunks": total_chunks}
+    _sync_registry()
+    with _registry_lock:
+        return {
+            "documents": len(_doc_registry),
+            "total_chunks": sum(entry["chunks"] for entry in _doc_registry.values()),
+        }